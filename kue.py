@@ -41,10 +41,10 @@ from qgis.core import (
 )
 from qgis.core import QgsFillSymbol
 
-from .kue_task import KueTask
+from .kue_task import KueRequest
 from .kue_geoprocessing import KueGeoprocessingTask
 from .kue_messages import KUE_INTRODUCTION_MESSAGES, KUE_ASK_KUE
-from .kue_sidebar import KueSidebar
+from .kue_sidebar import KueSidebar, AUTH_BUS
 from .kue_find import KueFind
 
 
@@ -137,6 +137,7 @@ class KuePlugin:
             QUrl(f"https://buntinglabs.com/account/register?kue_token={key}")
         )
         QSettings().setValue("buntinglabs-kue/auth_token", key)
+        AUTH_BUS.tokenChanged.emit()
 
     # ================================================
     # AI Management (inputs and outputs)
@@ -755,13 +756,16 @@ class KuePlugin:
     def onEnterClicked(self, text: str, history: list[str]):
         history_str = "\n".join(history)[-2048:]
 
-        kue_task = KueTask(
+        kue_request = KueRequest(
             text, self.createKueContext(), history_str, self.plugin_version
         )
-        kue_task.responseReceived.connect(self.handleKueResponse)
-        kue_task.errorReceived.connect(self.handleKueError)
-        QgsApplication.taskManager().addTask(kue_task)
-        self.task_trash.append(kue_task)
+        kue_request.responseReceived.connect(self.handleKueResponse)
+        kue_request.streamingContentReceived.connect(
+            self.text_dock_widget.onStreamingContent
+        )
+        kue_request.errorReceived.connect(self.handleKueError)
+        kue_request.start()
+        self.task_trash.append(kue_request)  # Prevent garbage collection
 
         self.text_dock_widget.addMessage(
             {"role": "user", "msg": text, "has_button": False}
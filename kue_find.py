@@ -17,6 +17,7 @@ from qgis.core import (
     Qgis,
     QgsMessageLog,
 )
+from qgis.PyQt.QtCore import pyqtSignal
 
 # I'm not sure sqlite3 is always available.
 KUE_SQLITE_PATH = os.path.join(os.path.dirname(__file__), "find_file_index.sqlite")
@@ -363,6 +364,25 @@ class IndexingTask(QgsTask):
             self.setProgress(100)
 
 
+class KueFindTask(QgsTask):
+    # Emitted from finished() on the main thread with the search results
+    resultsReady = pyqtSignal(list)
+
+    def __init__(self, kue_find, query: str):
+        super().__init__("Searching files for Kue /find", QgsTask.CanCancel)
+        self.kue_find = kue_find
+        self.query = query
+        self.results = []
+
+    def run(self):
+        self.results = self.kue_find.search(self.query)
+        return True
+
+    def finished(self, result):
+        if result and not self.isCanceled():
+            self.resultsReady.emit(self.results)
+
+
 class KueFind:
     def __init__(self):
         self.files = []
@@ -388,9 +408,10 @@ class KueFind:
         self.index_task_trash.append(self.index_task)  # Prevent garbage collection
 
     def search(self, query: str, n: int = 12):
-        # Start indexing if not already started
-        if not self.files and self.index_task is None:
-            self.index(os.path.expanduser("~"))
+        # This runs on a task-pool thread (KueFindTask), which must not
+        # schedule new tasks: the sidebar starts indexing from the main
+        # thread before dispatching searches
+        if not self.files:
             return []
 
         query_words = query.lower().split()
@@ -8,20 +8,84 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QHBoxLayout,
     QVBoxLayout,
-    QListWidget,
+    QListView,
     QFrame,
-    QListWidgetItem,
     QLabel,
-    QTextEdit,
+    QPlainTextEdit,
+    QShortcut,
 )
-from PyQt5.QtCore import Qt, QSettings, QTimer
-from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsProject
+from PyQt5.QtGui import QKeySequence, QTextCursor
+from PyQt5.QtCore import (
+    Qt,
+    QSettings,
+    QTimer,
+    QObject,
+    pyqtSignal,
+    QAbstractListModel,
+    QModelIndex,
+)
+from qgis.core import QgsVectorLayer, QgsRasterLayer, QgsProject, QgsApplication
 from qgis.core import QgsIconUtils
 
 from typing import Callable
+from collections import OrderedDict
+import functools
 import os
 import re
-from .kue_find import KueFind, VECTOR_EXTENSIONS, RASTER_EXTENSIONS
+from .kue_find import KueFind, KueFindTask, VECTOR_EXTENSIONS, RASTER_EXTENSIONS
+
+# Cached once: expanduser does env lookups and allocates a fresh string
+# on every call, and we hit it per result row and per drag/click.
+_HOME = os.path.expanduser("~")
+
+
+class KueAuthBus(QObject):
+    # Emitted whenever the auth token in QSettings is (re)written, so the
+    # sidebar can react immediately instead of polling QSettings.
+    tokenChanged = pyqtSignal()
+
+
+AUTH_BUS = KueAuthBus()
+
+# Compiled once: these run on every message, and re.sub with a string
+# pattern pays a cache lookup per call.
+_BOLD_RE = re.compile(r"\*\*(.*?)\*\*")
+_ITAL_RE = re.compile(r"\*(.*?)\*")
+_LINK_RE = re.compile(r"\[(.*?)\]\((.*?)\)")
+
+
+@functools.lru_cache(maxsize=8)
+def _icon_for(file_type, geom_type):
+    # Only a handful of distinct icons exist; memoize instead of asking
+    # QgsIconUtils for a fresh QIcon per result row
+    if file_type == "vector":
+        return {
+            "Point": QgsIconUtils.iconPoint(),
+            "Line String": QgsIconUtils.iconLine(),
+        }.get(geom_type, QgsIconUtils.iconPolygon())
+    if file_type == "raster":
+        return QgsIconUtils.iconRaster()
+    return QgsIconUtils.iconDefaultLayer()
+
+
+@functools.lru_cache(maxsize=256)
+def format_message_html(text: str) -> str:
+    # Super simple markdown formatting, done once per message so each
+    # message ends up as a single HTML append into the chat display.
+    # Cached because the fixed starter messages (and repeated assistant
+    # replies) get re-added verbatim.
+    text = text.replace("\n", "<br>")
+    # One cheap C-level scan per marker type beats unconditionally running
+    # the regex engine over marker-free messages (the common case)
+    if "[" in text:
+        text = _LINK_RE.sub(
+            r'<a href="\2" style="color: blue; text-decoration: underline;">\1</a>',
+            text,
+        )
+    if "*" in text:
+        text = _BOLD_RE.sub(r"<b>\1</b>", text)
+        text = _ITAL_RE.sub(r"<i>\1</i>", text)
+    return text
 
 
 class KueSidebar(QDockWidget):
@@ -37,6 +101,9 @@ class KueSidebar(QDockWidget):
 
         # Properties
         self.iface = iface
+        # One QSettings instance; constructing it re-opens the ini/registry
+        # backend on some platforms
+        self._settings = QSettings()
         self.messageSent = messageSent
         self.authenticateUser = authenticateUser
         self.kue_find = kue_find
@@ -86,15 +153,19 @@ class KueSidebar(QDockWidget):
         self.textbox.returnPressed.connect(self.onEnterClicked)
         self.textbox.textChanged.connect(self.onTextUpdate)
 
-        def handleKeyPress(e):
-            if e.key() == Qt.Key_Up:
-                user_messages = [msg for msg in [] if msg["role"] == "user"]
-                if user_messages:
-                    self.textbox.setText(user_messages[-1]["msg"])
-            else:
-                QLineEdit.keyPressEvent(self.textbox, e)
+        # Raw chat history as {role, msg} dicts; the widget is for display
+        # only, so sending never has to re-parse its plain text
+        self._history = []
 
-        self.textbox.keyPressEvent = handleKeyPress
+        # Cursor pinned to the block receiving streamed text, so chunks
+        # are inserted in place instead of re-rendering the message
+        self._streaming_cursor = None
+
+        # A widget-scoped shortcut dispatches in C++, so ordinary keystrokes
+        # never cross into Python (unlike a keyPressEvent override)
+        self._up_shortcut = QShortcut(QKeySequence(Qt.Key_Up), self.textbox)
+        self._up_shortcut.setContext(Qt.WidgetShortcut)
+        self._up_shortcut.activated.connect(self.onHistoryUp)
 
         self.enter_button = QPushButton("Enter")
         self.enter_button.setFixedSize(50, 20)
@@ -112,10 +183,17 @@ class KueSidebar(QDockWidget):
         # Build kue widget
         self.kue_widget = QWidget()
 
-        self.chat_display = QTextEdit()
+        # QPlainTextEdit appends in O(new block) rather than re-laying out
+        # the whole document like QTextEdit, and the block cap keeps long
+        # conversations from growing the layout cost unboundedly.
+        self.chat_display = QPlainTextEdit()
         self.chat_display.setReadOnly(True)
         self.chat_display.setFrameShape(QFrame.NoFrame)
         self.chat_display.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.chat_display.setMaximumBlockCount(500)
+        self.chat_display.setUndoRedoEnabled(False)
+        # One sip-bound property lookup instead of two per append
+        self._vsb = self.chat_display.verticalScrollBar()
 
         self.kue_layout = QVBoxLayout()
         self.kue_layout.setContentsMargins(0, 0, 0, 0)
@@ -126,13 +204,20 @@ class KueSidebar(QDockWidget):
         self.find_layout = QVBoxLayout()
         self.find_layout.setContentsMargins(0, 0, 0, 0)
 
-        self.find_results = FileListWidget()
-        self.find_results.setWordWrap(True)
+        # A lazy model + view: only visible rows are asked for their data,
+        # so building a large result set doesn't stall the UI thread
+        self.find_results = QListView()
+        self.find_results_model = KueFindResultsModel(self)
+        self.find_results.setModel(self.find_results_model)
         self.find_results.setFrameShape(QFrame.NoFrame)
         self.find_results.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        self.find_results.setTextElideMode(Qt.ElideNone)
         self.find_results.setDragEnabled(True)
-        self.find_results.setDragDropMode(QListWidget.DragOnly)
+        self.find_results.setDragDropMode(QListView.DragOnly)
+        self.find_results.setLayoutMode(QListView.Batched)
+        self.find_results.setBatchSize(30)
+        # The delegate's sizeHint is a constant 40 px, so let the view
+        # skip per-row size measurement
+        self.find_results.setUniformItemSizes(True)
 
         # Handle opening a file
         delegate = KueFileResult()
@@ -159,43 +244,76 @@ class KueSidebar(QDockWidget):
         self.parent_widget.addWidget(self.auth_widget)
 
         self.parent_widget.setCurrentIndex(
-            0 if QSettings().value("buntinglabs-kue/auth_token") else 1
+            0 if self._settings.value("buntinglabs-kue/auth_token") else 1
         )
 
         self.setWidget(self.parent_widget)
 
-        # Set up a timer to poll the QSettings value
-        self.poll_timer = QTimer(self)
-        self.poll_timer.timeout.connect(self.checkAuthToken)
-        self.poll_timer.start(5000)  # 5 seconds
+        # React to the auth token being written instead of polling QSettings
+        AUTH_BUS.tokenChanged.connect(self.checkAuthToken)
+
+        # Cheap boolean checked before any Qt property reads; keeps the
+        # search path from doing work when the user isn't in /find mode
+        self._find_active = False
+
+        # Debounce /find searches so a typing burst triggers one search,
+        # not one per keystroke
+        self._search_timer = QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(150)
+        self._search_timer.timeout.connect(self._doSearch)
+        self._pending_query = ""
+        self._find_task = None
+        self._find_task_trash = []  # Keep reference to prevent garbage collection
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Catch a token change that happened while the dock was hidden
+        self.checkAuthToken()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        # No point searching while nothing is visible
+        self._search_timer.stop()
 
     def checkAuthToken(self):
         # Check if the auth token is set and update the widget index accordingly
-        if QSettings().value("buntinglabs-kue/auth_token"):
-            self.parent_widget.setCurrentIndex(0)
-        else:
-            self.parent_widget.setCurrentIndex(1)
+        new_idx = 0 if self._settings.value("buntinglabs-kue/auth_token") else 1
+        if self.parent_widget.currentIndex() != new_idx:
+            self.parent_widget.setCurrentIndex(new_idx)
+
+    def onStreamingContent(self, chunk):
+        if self._streaming_cursor is None:
+            self.chat_display.appendPlainText("")
+            cursor = self.chat_display.textCursor()
+            cursor.movePosition(QTextCursor.End)
+            self._streaming_cursor = cursor
+        at_bottom = self._vsb.value() == self._vsb.maximum()
+        self._streaming_cursor.insertText(chunk)
+        if at_bottom:
+            # Let the widget scroll just enough to reveal the new text; it
+            # skips the work entirely when the end is already in view
+            self.chat_display.moveCursor(QTextCursor.End)
+            self.chat_display.ensureCursorVisible()
 
     def addMessage(self, msg):
-        # Super simple markdown formatting
-        msg["msg"] = msg["msg"].replace("\n", "<br>")
-        msg["msg"] = re.sub(r"\*\*(.*?)\*\*", r"<b>\1</b>", msg["msg"])
-        msg["msg"] = re.sub(r"\*(.*?)\*", r"<i>\1</i>", msg["msg"])
-
-        # Format message based on role
+        # A complete message ends any in-progress streamed block
+        self._streaming_cursor = None
+        self._history.append({"role": msg["role"], "msg": msg["msg"]})
+        msg["msg"] = format_message_html(msg["msg"])
+
+        # Format message based on role. QPlainTextEdit ignores block
+        # alignment and resource images, so distinguish roles with
+        # character-level styling it does render: a colored bold prefix
+        # for the user, red text for errors, a gear for geoprocessing.
         if msg["role"] == "user":
-            html = f'<div style="text-align: right; margin: 8px;">{msg["msg"]}</div>'
+            html = f'<div style="margin: 8px;"><b style="color: #0b5394;">You:</b> {msg["msg"]}</div>'
         elif msg["role"] == "error":
-            html = f'<div style="text-align: left; margin: 8px; color: red;">{msg["msg"]}</div>'
+            html = f'<div style="margin: 8px; color: red;">{msg["msg"]}</div>'
         elif msg["role"] == "geoprocessing":
-            html = f"""
-                <div style="margin: 8px;">
-                    <img src=":/images/themes/default/processingAlgorithm.svg" width="16" height="16" style="vertical-align: middle"/>
-                    <span>{msg["msg"]}</span>
-                </div>
-            """
+            html = f'<div style="margin: 8px;">⚙ {msg["msg"]}</div>'
         else:
-            html = f'<div style="text-align: left; margin: 8px;">{msg["msg"]}</div>'
+            html = f'<div style="margin: 8px;">{msg["msg"]}</div>'
 
         # Add run code button if needed
         if msg.get("has_button"):
@@ -208,19 +326,14 @@ class KueSidebar(QDockWidget):
                 </div>
             """
 
-        # Append and scroll to bottom
-        cursor = self.chat_display.textCursor()
-        cursor.movePosition(cursor.End)
-        self.chat_display.setTextCursor(cursor)
-
-        self.chat_display.append("")
-        self.chat_display.setAlignment(
-            Qt.AlignRight if msg["role"] == "user" else Qt.AlignLeft
-        )
-        self.chat_display.insertHtml(html)
-        self.chat_display.verticalScrollBar().setValue(
-            self.chat_display.verticalScrollBar().maximum()
-        )
+        # Append, then follow the bottom only if the user was already
+        # there, so we don't fight someone scrolled back in the history.
+        # No blank spacer block: the div margin provides the separation.
+        at_bottom = self._vsb.value() == self._vsb.maximum()
+        self.chat_display.appendHtml(html)
+        if at_bottom:
+            self.chat_display.moveCursor(QTextCursor.End)
+            self.chat_display.ensureCursorVisible()
 
     def onChatButtonClicked(self, msg):
         # Handle button click
@@ -233,16 +346,17 @@ class KueSidebar(QDockWidget):
         QApplication.clipboard().setText(msg["msg"])
         console._console.console.pasteEditor()
 
+    def onHistoryUp(self):
+        user_messages = [m for m in self._history if m["role"] == "user"]
+        if user_messages:
+            self.textbox.setText(user_messages[-1]["msg"])
+
     def onEnterClicked(self):
         if self.textbox.text().startswith("/find"):
             return
         text = self.textbox.text()
-        # Extract just the message text from the HTML divs/spans
-        history = []
-        for line in self.chat_display.toPlainText().split("\n"):
-            line = line.strip()
-            if line and not line.startswith("<") and not line.endswith(">"):
-                history.append(line)
+        # O(recent messages) rather than re-parsing the whole widget text
+        history = [m["msg"] for m in self._history[-40:]]
         self.messageSent(text, history)
         self.textbox.clear()
 
@@ -256,56 +370,113 @@ class KueSidebar(QDockWidget):
 
     def onTextUpdate(self, text):
         if text.startswith("/find"):
+            self._find_active = True
+            self._pending_query = text[5:].strip()
             self.above_mb_widget.setCurrentIndex(1)
-
-            query = text[5:].strip()
-            self.find_results.clear()
-
-            # Search
-            results = self.kue_find.search(query)
-            for path, atime, file_type, geom_type, location in results:
-                item = QListWidgetItem()
-                item.setData(
-                    Qt.UserRole,
-                    {
-                        "path": path.replace(os.path.expanduser("~"), "~"),
-                        "atime": atime,
-                        "location": location,
-                    },
-                )
-                if file_type == "vector":
-                    if geom_type == "Point":
-                        item.setIcon(QgsIconUtils.iconPoint())
-                    elif geom_type == "Line String":
-                        item.setIcon(QgsIconUtils.iconLine())
-                    else:
-                        item.setIcon(QgsIconUtils.iconPolygon())
-                elif file_type == "raster":
-                    item.setIcon(QgsIconUtils.iconRaster())
-                else:
-                    item.setIcon(QgsIconUtils.iconDefaultLayer())
-                self.find_results.addItem(item)
+            self._search_timer.start()
         else:
+            self._find_active = False
+            self._search_timer.stop()
             self.above_mb_widget.setCurrentIndex(0)
 
+    def _doSearch(self):
+        if not self._find_active:
+            return
+
+        # First use: start indexing here on the main thread. QgsTask
+        # completion is delivered to the thread that created the task, so
+        # scheduling it from a pool thread (e.g. inside KueFind.search)
+        # would mean its results never arrive.
+        if not self.kue_find.files and self.kue_find.index_task is None:
+            self.kue_find.index(_HOME)
+            return
+
+        # Run the search off the UI thread; a newer query supersedes any
+        # still-running task
+        if self._find_task is not None:
+            self._find_task.cancel()
+        task = KueFindTask(self.kue_find, self._pending_query)
+        task.resultsReady.connect(self._populateResults)
+        QgsApplication.taskManager().addTask(task)
+        self._find_task = task
+        self._find_task_trash.append(task)
+
+    def _populateResults(self, results):
+        if not self._find_active:
+            return
+        rows = []
+        for path, atime, file_type, geom_type, location in results:
+            # Only Point and Line String get distinct icons; collapse every
+            # other geometry so _icon_for's cache holds a handful of keys
+            # regardless of what the index reports
+            if file_type == "vector" and geom_type not in ("Point", "Line String"):
+                geom_type = "Polygon"
+            elif file_type != "vector":
+                geom_type = None
+            display_path = path.replace(_HOME, "~")
+            dirname = os.path.dirname(display_path)
+            rows.append(
+                {
+                    "path": display_path,
+                    # The original path, so opening/dragging never has to
+                    # undo the "~" substitution
+                    "abs_path": path,
+                    # QStaticText caches glyph layout across repaints, so
+                    # format the two labels once here instead of per frame
+                    "first_static": QStaticText(f"{dirname} (opened {atime})"),
+                    "name_static": QStaticText(os.path.basename(display_path)),
+                    "atime": atime,
+                    "location": location,
+                    "file_type": file_type,
+                    "geometry_type": geom_type,
+                }
+            )
+        self.find_results_model.setResults(rows)
+
 
 from PyQt5.QtWidgets import QAbstractItemDelegate
-from PyQt5.QtCore import QSize
+from PyQt5.QtCore import QSize, QPoint, QRect
 from PyQt5.QtWidgets import QStyle
 from PyQt5.QtCore import QMimeData, QUrl
+from PyQt5.QtGui import QStaticText, QFont, QPixmap, QPainter
 
 
-class FileListWidget(QListWidget):
+class KueFindResultsModel(QAbstractListModel):
     def __init__(self, parent=None):
         super().__init__(parent)
+        self._rows = []
+
+    def setResults(self, rows):
+        self.beginResetModel()
+        self._rows = rows
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = self._rows[index.row()]
+        if role == Qt.UserRole:
+            return row
+        if role == Qt.DecorationRole:
+            # Resolved lazily, so icons are only built for visible rows
+            return _icon_for(row["file_type"], row["geometry_type"])
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
 
     def mimeTypes(self):
         return ["text/uri-list"]
 
-    def mimeData(self, items):
+    def mimeData(self, indexes):
         data = QMimeData()
         urls = []
-        path = items[0].data(Qt.UserRole)["path"].replace("~", os.path.expanduser("~"))
+        path = indexes[0].data(Qt.UserRole)["abs_path"]
         urls.append(QUrl.fromLocalFile(path))
         data.setUrls(urls)
         return data
@@ -316,11 +487,17 @@ class KueFileResult(QAbstractItemDelegate):
         super().__init__()
         self.open_vector = open_vector
         self.open_raster = open_raster
+        # Built lazily from the first paint's option.font, so we stop
+        # toggling bold on a shared QFont every row
+        self._normal_font = None
+        self._bold_font = None
+        # Fully rendered rows, LRU-evicted; scrolling then costs one
+        # drawPixmap per row instead of icon + text layout work
+        self._row_cache = OrderedDict()
 
     def editorEvent(self, event, model, option, index):
         if event.type() == event.MouseButtonDblClick:
-            path = index.data(Qt.UserRole)["path"]
-            path = path.replace("~", os.path.expanduser("~"))
+            path = index.data(Qt.UserRole)["abs_path"]
 
             # Trigger appropriate open
             if path.endswith(VECTOR_EXTENSIONS) and self.open_vector:
@@ -331,66 +508,91 @@ class KueFileResult(QAbstractItemDelegate):
         return False
 
     def paint(self, painter, option, index):
+        item_data = index.data(Qt.UserRole)
+        selected = bool(option.state & QStyle.State_Selected)
+        key = (
+            item_data["path"],
+            item_data["atime"],
+            item_data["location"],
+            selected,
+            option.rect.width(),
+        )
+        pm = self._row_cache.get(key)
+        if pm is None:
+            pm = self._renderRow(painter, option, index, item_data, selected)
+            self._row_cache[key] = pm
+            while len(self._row_cache) > 512:
+                self._row_cache.popitem(last=False)
+        else:
+            self._row_cache.move_to_end(key)
+        painter.drawPixmap(option.rect.topLeft(), pm)
+
+    def _renderRow(self, painter, option, index, item_data, selected):
+        dpr = painter.device().devicePixelRatioF()
+        rect = QRect(0, 0, option.rect.width(), option.rect.height())
+        pm = QPixmap(int(rect.width() * dpr), int(rect.height() * dpr))
+        pm.setDevicePixelRatio(dpr)
+        pm.fill(Qt.transparent)
+        p = QPainter(pm)
+
         # Draw background if selected
-        if option.state & QStyle.State_Selected:
-            painter.fillRect(option.rect, option.palette.highlight())
+        if selected:
+            p.fillRect(rect, option.palette.highlight())
 
         # Draw bottom line
-        painter.setPen(option.palette.dark().color())
-        painter.drawLine(
-            option.rect.left(),
-            option.rect.bottom(),
-            option.rect.right(),
-            option.rect.bottom(),
-        )
+        p.setPen(option.palette.dark().color())
+        p.drawLine(rect.left(), rect.bottom(), rect.right(), rect.bottom())
 
         # Text color depends on select state
-        if option.state & QStyle.State_Selected:
-            painter.setPen(option.palette.highlightedText().color())
+        if selected:
+            p.setPen(option.palette.highlightedText().color())
         else:
-            painter.setPen(option.palette.text().color())
+            p.setPen(option.palette.text().color())
 
         # Get the icon, draw on top of bg
         icon = index.data(Qt.DecorationRole)
         if icon:
-            icon_rect = option.rect.adjusted(4, 4, -option.rect.width() + 24, -4)
-            icon.paint(painter, icon_rect)
-
-        path = index.data(Qt.UserRole)["path"]
-        filename = os.path.basename(path)
-        dirname = os.path.dirname(path)
-
-        atime = index.data(Qt.UserRole)["atime"]
-        location = index.data(Qt.UserRole)["location"]
-
-        # Draw filename on first line with offset for icon
-        font = painter.font()
-        font.setBold(False)
-        painter.setFont(font)
-        text_rect = option.rect.adjusted(28, 4, -4, -int(option.rect.height() / 2))
-        painter.drawText(
-            text_rect, Qt.AlignLeft | Qt.AlignVCenter, f"{dirname} (opened {atime})"
-        )
-
-        # Draw dirname on second line
-        font.setBold(True)
-        painter.setFont(font)
-        painter.drawText(
-            option.rect.adjusted(28, int(option.rect.height() / 2), -4, -4),
-            Qt.AlignLeft | Qt.AlignVCenter,
-            filename,
-        )
+            icon_rect = rect.adjusted(4, 4, -rect.width() + 24, -4)
+            icon.paint(p, icon_rect)
+
+        location = item_data["location"]
+
+        if self._normal_font is None:
+            self._normal_font = QFont(option.font)
+            self._normal_font.setBold(False)
+            self._bold_font = QFont(option.font)
+            self._bold_font.setBold(True)
+
+        half_height = int(rect.height() / 2)
+
+        # Draw dirname + atime on first line with offset for icon
+        p.setFont(self._normal_font)
+        text_rect = rect.adjusted(28, 4, -4, -half_height)
+        line_y = text_rect.top() + (
+            text_rect.height() - p.fontMetrics().height()
+        ) // 2
+        p.drawStaticText(QPoint(text_rect.left(), line_y), item_data["first_static"])
+
+        # Draw filename on second line
+        p.setFont(self._bold_font)
+        name_rect = rect.adjusted(28, half_height, -4, -4)
+        line_y = name_rect.top() + (
+            name_rect.height() - p.fontMetrics().height()
+        ) // 2
+        p.drawStaticText(QPoint(name_rect.left(), line_y), item_data["name_static"])
         # Location is lighter gray
-        if option.state & QStyle.State_Selected:
-            painter.setPen(option.palette.highlightedText().color().lighter())
+        if selected:
+            p.setPen(option.palette.highlightedText().color().lighter())
         else:
-            painter.setPen(option.palette.text().color().lighter())
+            p.setPen(option.palette.text().color().lighter())
 
-        painter.drawText(
-            option.rect.adjusted(28, int(option.rect.height() / 2), -4, -4),
+        p.drawText(
+            rect.adjusted(28, half_height, -4, -4),
             Qt.AlignRight | Qt.AlignVCenter,
             location,
         )
+        p.end()
+        return pm
 
     def sizeHint(self, option, index):
         return QSize(option.rect.width(), 40)
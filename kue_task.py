@@ -1,88 +1,331 @@
 # Copyright 2024 Bunting Labs, Inc.
 
+import codecs
 import json
+from time import monotonic
 
-from qgis.core import QgsTask, QgsNetworkAccessManager
-from qgis.PyQt.QtCore import QSettings, pyqtSignal, QUrl, QEventLoop, QTimer
+from qgis.core import QgsNetworkAccessManager
+from qgis.PyQt.QtCore import QObject, QSettings, pyqtSignal, QUrl
 from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
 from qgis.PyQt.QtCore import QByteArray
 from qgis.core import QgsMessageLog, Qgis
 from PyQt5.QtGui import QDesktopServices
 
+try:
+    from qgis.PyQt import sip
+except ImportError:
+    sip = None
+
+# Hoisted out of the streaming path: the marker is scanned for on every
+# chunk
+_ACTIONS_MARKER = b'{"actions":'
+# Consumed-prefix size at which the parser buffer is compacted
+_COMPACT_THRESHOLD = 64 * 1024
+
+try:
+    # Optional: parses several times faster than the stdlib and takes
+    # bytes directly, skipping a UTF-8 decode pass
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj):
+        # Serializes straight to UTF-8 bytes, skipping the str round trip
+        return orjson.dumps(obj)
+
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj):
+        # ensure_ascii=False keeps non-ASCII text as UTF-8 instead of
+        # inflating it to \uXXXX escapes
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode(
+            "utf-8"
+        )
+
+
+class _IncrementalActionParser:
+    """Splits a streamed response into leading chat text and the action
+    objects that follow, scanning each byte exactly once.
+
+    A response is optional chat text followed by one or more concatenated
+    JSON objects, the first starting with ``{"actions":``. Re-parsing the
+    whole buffer on every chunk would be quadratic in the response size;
+    instead this keeps a brace-depth scanner's state across feeds and only
+    walks the newly appended bytes.
+    """
+
+    def __init__(self, on_text, on_object):
+        self.on_text = on_text
+        self.on_object = on_object
+        self._buf = bytearray()
+        self._in_actions = False
+        # Scanner state, carried across feeds so a chunk boundary can fall
+        # anywhere inside an object, a string, or an escape sequence.
+        # _start marks the first unconsumed byte; consumed prefixes are
+        # trimmed lazily rather than after every object.
+        self._scan = 0
+        self._start = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, data, final=False):
+        self._buf.extend(data)
+        if not self._in_actions:
+            self._drain_text(final)
+        if self._in_actions:
+            self._drain_objects()
+
+    def _drain_text(self, final):
+        i = self._buf.find(_ACTIONS_MARKER)
+        if i != -1:
+            text = bytes(self._buf[:i])
+            del self._buf[:i]
+            self._in_actions = True
+        elif self._buf.lstrip()[:1] == b"{":
+            # Probably an action frame whose marker is split across chunks
+            return
+        elif final:
+            text = bytes(self._buf)
+            self._buf.clear()
+        else:
+            # Hold back a marker's worth of bytes in case it's split
+            keep = len(_ACTIONS_MARKER) - 1
+            text = bytes(self._buf[:-keep])
+            del self._buf[:-keep]
+        done = final or self._in_actions
+        if text or done:
+            self.on_text(text, done)
+
+    def _drain_objects(self):
+        buf = self._buf
+        pos = self._scan
+        start = self._start
+        depth = self._depth
+        in_string = self._in_string
+        escape = self._escape
+        n = len(buf)
+        while pos < n:
+            c = buf[pos]
+            pos += 1
+            if in_string:
+                if escape:
+                    escape = False
+                elif c == 0x5C:  # backslash
+                    escape = True
+                elif c == 0x22:  # quote
+                    in_string = False
+            elif c == 0x22:
+                in_string = True
+            elif c == 0x7B:  # {
+                depth += 1
+            elif c == 0x7D:  # }
+                depth -= 1
+                if depth == 0:
+                    # One complete object; whitespace around it is fine
+                    # for the JSON parser. Advance the cursor instead of
+                    # deleting, which would memmove the tail per object.
+                    self.on_object(bytes(buf[start:pos]))
+                    start = pos
+        if start > _COMPACT_THRESHOLD:
+            del buf[:start]
+            pos -= start
+            start = 0
+        self._scan = pos
+        self._start = start
+        self._depth = depth
+        self._in_string = in_string
+        self._escape = escape
+
+    def remainder(self):
+        # Bytes fed but consumed neither as text nor as a completed
+        # object: a held-back buffer that never matched the actions
+        # marker, or a truncated trailing object
+        return bytes(self._buf[self._start :])
+
+
+# Static multipart fragments, encoded once at import instead of per request
+_CD_REQ = b'--boundary\r\nContent-Disposition: form-data; name="req"\r\n\r\n'
+_CD_CTX = b'\r\n--boundary\r\nContent-Disposition: form-data; name="context"\r\n\r\n'
+_CD_HIST = (
+    b'\r\n--boundary\r\nContent-Disposition: form-data; name="chat_history"\r\n\r\n'
+)
+_MP_TAIL = b"\r\n--boundary--\r\n"
+
+# Read the reply in bounded slices so a large backlog is parsed (and its
+# buffer reclaimed) piecewise instead of materialized all at once
+_READ_CHUNK = 64 * 1024
+
+
+def _build_multipart(user_request, kue_context, history_str):
+    # One join into a right-sized buffer
+    return b"".join(
+        (
+            _CD_REQ,
+            user_request.encode("utf-8"),
+            _CD_CTX,
+            _dumps(kue_context),
+            _CD_HIST,
+            history_str.encode("utf-8"),
+            _MP_TAIL,
+        )
+    )
+
+
+# Error messages for status codes that need no extra handling; 403 is
+# special-cased in _on_finished because it has side effects
+_STATUS_MESSAGES = {
+    402: "Kue requires a subscription. Go to buntinglabs.com/dashboard to enter your payment information.",
+    500: "Sorry: unexpected bug on Kue's server, our team will investigate.",
+    502: "Kue server seems to be down, sorry, please try again later.",
+}
+
+
+class KueRequest(QObject):
+    """An in-flight request to the Kue API.
+
+    QNetworkAccessManager already does its I/O asynchronously on the main
+    event loop, so there is no worker thread and no nested event loop
+    here — just signal connections on the reply. Callers construct one,
+    wire up the signals, call start(), and keep a reference until done.
+    """
 
-class KueTask(QgsTask):
     responseReceived = pyqtSignal(dict)
+    # Chat text that precedes the actions JSON, emitted as it arrives
+    streamingContentReceived = pyqtSignal(str)
     errorReceived = pyqtSignal(str)
 
     def __init__(self, user_request, kue_context, history_str, kue_version):
-        super().__init__("Waiting for Kue to respond", QgsTask.CanCancel)
+        super().__init__()
         self.user_request = user_request
         self.kue_context = kue_context
         self.history_str = history_str
         self.kue_version = kue_version
+        # Constant for the lifetime of the task; encode once, not per send
+        self._kue_version_bytes = kue_version.encode("utf-8")
+
+        # Consumes raw chunks as they arrive and calls back with chat text
+        # and completed action objects
+        self._parser = _IncrementalActionParser(self._on_text, self._on_action)
+        # Holds partial UTF-8 sequences across chunk boundaries, so a
+        # multi-byte character split between reads decodes correctly
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        # Coalesce streamed text so the UI repaints at most ~30 fps even
+        # when the network delivers many small chunks per second
+        self._emit_pending = ""
+        self._last_emit = 0.0
+        # Set in start() so abort() can stop the transfer immediately
+        self._reply = None
+        self._aborted = False
+        self._failed = False
 
-    def run(self):
+    def handle_ready_read(self):
+        reply = self._reply
+        try:
+            while reply.bytesAvailable():
+                self._parser.feed(reply.read(_READ_CHUNK))
+        except Exception as e:
+            # A malformed action object must surface in chat like any
+            # other error, not escape from a Qt slot; stop the transfer
+            # since the stream can't be resynchronized
+            self._failed = True
+            self.errorReceived.emit(f"Kue error: {str(e)}")
+            reply.abort()
+
+    def _on_text(self, text, final):
+        decoded = self._text_decoder.decode(text, final)
+        if decoded:
+            self._emit_pending += decoded
+        if self._emit_pending and (
+            final or monotonic() - self._last_emit >= 0.03
+        ):
+            self.streamingContentReceived.emit(self._emit_pending)
+            self._emit_pending = ""
+            self._last_emit = monotonic()
+
+    def _on_action(self, payload):
+        # The scanner hands over exactly one complete JSON object
+        self.responseReceived.emit(_loads(payload))
+
+    def start(self):
         try:
             url = QUrl("https://qgis-api.buntinglabs.com/kue/v1")
 
+            # Read once per request; QSettings construction opens the
+            # backing store, and the 403 branch needs the token too
+            self._auth_token = QSettings().value(
+                "buntinglabs-kue/auth_token", "NO_AUTH_TOKEN"
+            )
+
             request = QNetworkRequest(url)
+            # Reuse one connection across tasks: HTTP/2 multiplexes
+            # concurrent requests and skips repeat TCP/TLS handshakes
+            request.setAttribute(QNetworkRequest.Http2AllowedAttribute, True)
+            request.setAttribute(QNetworkRequest.HttpPipeliningAllowedAttribute, True)
             request.setHeader(
                 QNetworkRequest.ContentTypeHeader,
                 "multipart/form-data; boundary=boundary",
             )
-            request.setRawHeader(
-                b"x-kue-token",
-                QSettings()
-                .value("buntinglabs-kue/auth_token", "NO_AUTH_TOKEN")
-                .encode("utf-8"),
-            )
-            request.setRawHeader(b"x-kue-version", self.kue_version.encode("utf-8"))
-
-            post_data = QByteArray()
-            post_data.append(b"--boundary\r\n")
-            post_data.append(b'Content-Disposition: form-data; name="req"\r\n\r\n')
-            post_data.append(self.user_request.encode("utf-8"))
-            post_data.append(b"\r\n--boundary\r\n")
-            post_data.append(b'Content-Disposition: form-data; name="context"\r\n\r\n')
-            post_data.append(json.dumps(self.kue_context).encode("utf-8"))
-            post_data.append(b"\r\n--boundary\r\n")
-            post_data.append(
-                b'Content-Disposition: form-data; name="chat_history"\r\n\r\n'
+            request.setRawHeader(b"x-kue-token", self._auth_token.encode("utf-8"))
+            request.setRawHeader(b"x-kue-version", self._kue_version_bytes)
+
+            # One join into a right-sized buffer instead of appending to a
+            # QByteArray piece by piece
+            post_data = QByteArray(
+                _build_multipart(self.user_request, self.kue_context, self.history_str)
             )
-            post_data.append(self.history_str.encode("utf-8"))
-            post_data.append(b"\r\n--boundary--\r\n")
 
             nam = QgsNetworkAccessManager.instance()
             reply = nam.post(request, post_data)
+            # Cap Qt's internal receive buffer; the parser consumes bytes
+            # as they arrive, so a large backlog just means the reader fell
+            # behind and TCP backpressure should kick in
+            reply.setReadBufferSize(256 * 1024)
+            self._reply = reply
+            # Bound method, not a lambda: one less Python frame per read
+            reply.readyRead.connect(self.handle_ready_read)
+            reply.finished.connect(self._on_finished)
 
-            loop = QEventLoop()
-            reply.finished.connect(loop.quit)
+        except Exception as e:
+            self.errorReceived.emit(f"Kue error: {str(e)}")
 
-            # Create a QTimer to periodically check if the task is cancelled
-            timer = QTimer()
-            timer.timeout.connect(lambda: self.isCanceled() and loop.quit())
-            timer.start(100)  # Check every 100 milliseconds
+    def _on_finished(self):
+        try:
+            reply = self._reply
+            reply.deleteLater()
 
-            loop.exec_()
+            if self._failed:
+                # Already reported from the read path
+                return
 
-            # If cancelled prematurely
-            if self.isCanceled():
+            if self._aborted:
                 self.errorReceived.emit("Request cancelled.")
-                return False
+                return
 
             if reply.error() == QNetworkReply.NoError:
-                content = reply.readAll().data().decode("utf-8")
-                data = json.loads(content)
-                self.responseReceived.emit(data)
-                return True
-            elif reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 402:
-                self.errorReceived.emit(
-                    "Kue requires a subscription. Go to buntinglabs.com/dashboard to enter your payment information."
-                )
-                return False
+                # Flush anything buffered after the last readyRead and
+                # emit whatever chat text is still coalescing; completed
+                # action objects were already emitted as they arrived
+                self._parser.feed(reply.readAll().data(), final=True)
+                self._on_text(b"", True)
+                # Anything the scanner didn't consume — e.g. an object
+                # that doesn't byte-match the actions marker exactly —
+                # still gets parsed whole, like the pre-streaming code
+                # did; a parse failure lands in the except below
+                leftover = self._parser.remainder().strip()
+                if leftover:
+                    self.responseReceived.emit(_loads(leftover))
+                return
+            # Read the status once; each attribute() call crosses into Qt
+            status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            if status in _STATUS_MESSAGES:
+                self.errorReceived.emit(_STATUS_MESSAGES[status])
             # Handle auth failed specifically
-            elif reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 403:
-                kue_token = QSettings().value("buntinglabs-kue/auth_token", "")
+            elif status == 403:
+                kue_token = (
+                    self._auth_token if self._auth_token != "NO_AUTH_TOKEN" else ""
+                )
                 if kue_token:
                     self.errorReceived.emit(
                         "Sign in to buntinglabs.com to connect your account. Opening a new tab."
@@ -94,35 +337,24 @@ class KueTask(QgsTask):
                     )
                 else:
                     self.errorReceived.emit("Restart Kue (or QGIS) to start using Kue.")
-
-                return False
-            # Unexpected server error
-            elif reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 500:
-                self.errorReceived.emit(
-                    "Sorry: unexpected bug on Kue's server, our team will investigate."
-                )
-                return False
-            # Bad Gateway
-            elif reply.attribute(QNetworkRequest.HttpStatusCodeAttribute) == 502:
-                self.errorReceived.emit(
-                    "Kue server seems to be down, sorry, please try again later."
-                )
-                return False
             else:
                 QgsMessageLog.logMessage(
-                    f"Kue error code: {reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)}",
+                    f"Kue error code: {status}",
                     "Kue",
                     Qgis.Warning,
                 )
                 self.errorReceived.emit(f"Kue error: {reply.errorString()}")
-                return False
 
         except Exception as e:
             self.errorReceived.emit(f"Kue error: {str(e)}")
-            return False
-
-    def finished(self, result):
-        pass
 
-    def cancel(self):
-        super().cancel()
+    def abort(self):
+        # Stop the in-flight transfer; _on_finished reports the
+        # cancellation. Guard against the reply's C++ object having
+        # already been deleted.
+        self._aborted = True
+        r = self._reply
+        if r is None or (sip is not None and sip.isdeleted(r)):
+            return
+        if not r.isFinished():
+            r.abort()